@@ -9,6 +9,7 @@ from solver import solve
 # gems (thanks to Coen van Leeuwen and Muche)
 
 # The solver only works on one color at the time, so do each color in turn.
+# To solve every color of every board at once, see solve_batch in solver.py.
 
 # The solver is designed to be used before you have started to merge gems. 
 # If you have already started a board and want to check, you can change the 
@@ -1,13 +1,38 @@
 """ Solver for the FOE anniversary event """
 from __future__ import annotations
-from math import ceil
-from typing import Tuple, List, Set, Union
+import atexit
+import heapq
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from operator import add, itemgetter, mul
+from zlib import crc32
+from typing import Dict, Optional, Tuple, List, Set, Union
 from enum import Enum
+import mooing15
 
-VERSION=3.2
+VERSION=3.3
 
-LOCK_TILE_WEIGHT = .01
-FREE_GEM_WEIGHT = .0001
+# Scores are integers that order solutions by keys first, then by locked tiles, and then by free
+# gems without a key part and merges together. The weights leave room for any board that fits in a
+# packed key (see pack), so a worse score on one of them can not be made up by the later ones
+KEY_WEIGHT = 10**12
+LOCK_TILE_WEIGHT = 10**6
+FREE_GEM_WEIGHT = 10
+MERGE_WEIGHT = 11
+
+def readable_score(score: int) -> float:
+    """ A score in keys, where a locked tile costs 0.01 key and a free gem without a key part or a
+    merge 0.0001 or 0.00011 key, like the scores were before they were integers """
+    keys = -(-score // KEY_WEIGHT)
+    locked, rest = divmod(keys * KEY_WEIGHT - score, LOCK_TILE_WEIGHT)
+    return keys - locked / 100 - rest / 100000
+
+NUM_KINDS = 32
 
 class Part(Enum):
     EMPTY = 0
@@ -17,38 +42,52 @@ class Part(Enum):
 
 # @functools.total_ordering
 class Gem():
+    """ A kind of gem. Only the 32 kinds in GEMS are ever created, every gem on a board is one of them """
+    __slots__ = ("level", "part", "locked", "free", "kind", "score")
+
     def __init__(self, level: int, part: Part, locked: bool):
         self.level = level
         self.part = part
         self.locked = locked
         self.free = not locked
-        self.moves: List[Move] = []
-        # Compute binary encoding for hashing and comparing
-        self._hash = int((self.level << 3) + (self.locked << 2) + self.part.value)
+        # Compute binary encoding for hashing, comparing and indexing the count vector of a State
+        self.kind = int((self.level << 3) + (self.locked << 2) + self.part.value)
 
         self.score = self._compute_score()
 
-    def _compute_score(self) -> float:
+    def _compute_score(self) -> int:
         lock_penalty = self.locked
-        keys = self.part == Part.FULL
+        keys = self.part == Part.FULL and self.level >= 2 # Keys only count from level 3
         empty_gem_penalty = self.part == Part.EMPTY
         if self.level == 3:
             keys *= 3
             lock_penalty *= 2
 
-        return keys - LOCK_TILE_WEIGHT * lock_penalty - FREE_GEM_WEIGHT * empty_gem_penalty
+        return KEY_WEIGHT * keys - LOCK_TILE_WEIGHT * lock_penalty - FREE_GEM_WEIGHT * empty_gem_penalty
 
     def can_merge_with(self, other: Gem) -> bool:
         return self.level == other.level and (self.free or other.free)
 
+    def merge(self, other: Gem) -> Gem:
+        """ The gem kind that results from merging this gem with another """
+        return GEMS[(min(3, self.level + 1) << 3) + (self.part.value | other.part.value)]
+
+    def mirror(self) -> Gem:
+        """ The same gem kind with the top and bottom key parts swapped """
+        return GEMS[MIRROR[self.kind]]
+
     def __hash__(self) -> int:
-        return self._hash
+        return self.kind
 
     def __eq__(self, other: Gem) -> bool:
-        return self.level == other.level and self.part == other.part and self.locked == other.locked
+        return self.kind == other.kind
 
     def __lt__(self, other: Gem) -> bool:
-        return self._hash < other._hash
+        return self.kind < other.kind
+
+    def __reduce__(self):
+        # Gems sent to other processes are the same kinds from GEMS there
+        return (_gem, (self.kind,))
 
     def __repr__(self) -> str:
         value = f"{'Locked' if self.locked else 'Free'} L{self.level + 1}"
@@ -56,62 +95,235 @@ class Gem():
             return f"{value} {self.part.name.capitalize()}"
         return value
 
+# All gem kinds, indexed by Gem.kind. Gems are immutable, so every gem on the board is one of these
+GEMS: List[Gem] = [Gem(kind >> 3, Part(kind & 3), bool(kind & 4)) for kind in range(NUM_KINDS)]
+SCORES: List[int] = [gem.score for gem in GEMS]
+
+def _gem(kind: int) -> Gem:
+    return GEMS[kind]
+
+# The game does not change when swapping the top and bottom key parts, this maps every gem kind
+# to the kind with the parts swapped
+MIRROR: List[int] = [(kind & ~3) | (kind & 1) << 1 | (kind & 2) >> 1 for kind in range(NUM_KINDS)]
+_mirror_counts = itemgetter(*MIRROR)
+
 Move = Tuple[Gem, ...]
 
-class MergedGem(Gem):
-    def __init__(self, move: Move):
-        assert move[0].level == move[1].level
-        super().__init__(min(3,move[0].level + 1),
-                            Part(move[0].part.value | move[1].part.value), False)
-        self.moves = move[0].moves + move[1].moves + [(move[0], move[1], self)]
+def mirror_move(move: Move) -> Move:
+    return tuple(gem.mirror() for gem in move)
+
+def move_order(move: Move) -> Tuple[int, ...]:
+    """ Canonical order of merges, so that independent merges are only tried in a single order
+
+    Lower level merges never depend on higher level ones, and below level 4 merges of the same
+    level do not depend on each other either. Merges with a locked gem come first, since free gems
+    of a level only merge together once they can no longer unlock a gem. Level 4 merges produce
+    gems for other level 4 merges, so they are not reordered. The order is the same for mirrored
+    merges, so it can be compared between a board and its mirror image """
+    one, two = move[0], move[1]
+    if one.level == 3:
+        return (3,)
+    if two.free:
+        return (one.level, 1)
+    return (one.level, 0, min(two.kind, MIRROR[two.kind]))
+
+# Fast heuristics that can give the branch and bound a score to beat from the start. They take the
+# six lists of the board, like solve, and change them into the board they end up with
+HEURISTICS = {
+    "mooing15": lambda *board: mooing15.solve(*board, silent=True),
+}
+
+# The gem kind of each of the six lists of a board, without the level
+BOARD_KINDS = (6, 5, 0, 2, 1, 3)
+
+def board_lists(counts: Tuple[int, ...]) -> List[List[int]]:
+    """ The six lists of a board (as passed to solve) from the number of gems of each kind """
+    return [[counts[(level << 3) + kind] for level in range(0,4)] for kind in BOARD_KINDS]
+
+def board_counts(board: List[List[int]]) -> Tuple[int, ...]:
+    """ The number of gems of each kind from the six lists of a board """
+    counts = [0] * NUM_KINDS
+    for kind, values in zip(BOARD_KINDS, board):
+        for level, count in enumerate(values):
+            counts[(level << 3) + kind] = count
+    return tuple(counts)
+
+def pack(counts: Tuple[int, ...]) -> int:
+    """ The number of gems of each kind packed into a single int, 8 bits per kind, so there can be
+    at most 255 gems of a kind """
+    return int.from_bytes(bytes(counts), "little")
+
+# Result of merging two gem kinds: the new gem, the change in score (including the merge), in the
+# number of tops and bottoms, in the number of free and locked gems per level (see State._levels),
+# the order of the merge (see move_order) and the change in the packed counts and in the packed
+# counts of the mirror image. None if the kinds can not be merged
+Merge = Tuple[Gem, int, int, int, Tuple[int, ...], Tuple[int, ...], int, int]
+
+def _merge(one: Gem, two: Gem) -> Optional[Merge]:
+    if not one.can_merge_with(two):
+        return None
+    new_gem = one.merge(two)
+    def change(part: Part) -> int:
+        return (new_gem.part == part) - (one.part == part) - (two.part == part)
+
+    levels = [0] * 8
+    levels[one.level + 4 * one.locked] -= 1
+    levels[two.level + 4 * two.locked] -= 1
+    levels[new_gem.level] += 1
+
+    def packed_change(one: Gem, two: Gem, new_gem: Gem) -> int:
+        return (1 << 8 * new_gem.kind) - (1 << 8 * one.kind) - (1 << 8 * two.kind)
+
+    return (new_gem, new_gem.score - one.score - two.score - MERGE_WEIGHT, change(Part.TOP),
+            change(Part.BOT), tuple(levels), move_order((one, two)),
+            packed_change(one, two, new_gem), packed_change(one.mirror(), two.mirror(), new_gem.mirror()))
+
+MERGES: List[List[Optional[Merge]]] = [[_merge(one, two) for two in GEMS] for one in GEMS]
+
+# Every possible floor of a state (see move_order) by its place in the order, starting at 1
+FLOOR_RANKS: Dict[Tuple[int, ...], int] = {floor: rank for rank, floor in enumerate(sorted(
+    {(0,)} | {merge[5] for merges in MERGES for merge in merges if merge}), start=1)}
 
 class EmptyState():
-    gems = []
+    counts = (0,) * NUM_KINDS
+    packed = 0
+    _key = counts
+    _packed = 0
+    _mirror_packed = 0
+    parent = None
+    move = None
+    depth = 0
+    floor = (0,)
 
 class State():
+    """ A board, stored as the number of gems of each kind (see Gem.kind)
+
+    A board and its mirror image (with top and bottom swapped) are considered equal """
+    __slots__ = ("counts", "packed", "parent", "move", "depth", "floor", "score", "potential_score",
+                 "_key", "_packed", "_mirror_packed", "_tops", "_bottoms", "_levels")
+
     def __init__(self, state: Union[EmptyState, State], move: Move = None):
-        self.gems: List[Gem] = state.gems.copy()
+        self.counts: Tuple[int, ...] = state.counts
+        # Packed counts of the board and of its mirror image, the lowest of them is the packed key
+        # (for hashing and the sets of visited states), which is the same for the mirror image
+        self._packed: int = state._packed
+        self._mirror_packed: int = state._mirror_packed
+        self.packed: int = state.packed
+        self._key: Optional[Tuple[int, ...]] = state._key # See key
+        self.parent: Optional[State] = state.parent # State before the last merge, see moves
+        self.move: Optional[Move] = state.move # Last merge, with the resulting gem
+        self.depth: int = state.depth # Number of merges done since the start
+        self.floor: Tuple[int, ...] = state.floor # Order of the last merge, see move_order
 
         if move:
-            self.gems.remove(move[0])
-            self.gems.remove(move[1])
-            new_gem = MergedGem(move)
-            self.gems.append(new_gem)
-            self.gems = sorted(self.gems) # Must sort for equality
+            one, two = move[0].kind, move[1].kind
+            new_gem, score, tops, bottoms, levels, self.floor, packed, mirror_packed = MERGES[one][two]
+            counts = list(self.counts)
+            counts[one] -= 1
+            counts[two] -= 1
+            counts[new_gem.kind] += 1
+            self.counts = tuple(counts)
+            self._packed += packed
+            self._mirror_packed += mirror_packed
+            self.packed = min(self._packed, self._mirror_packed)
+            self._key = None
+            self.parent = state
+            self.move = (move[0], move[1], new_gem)
+            self.depth += 1
 
             # Computing score based on previous. Makes it much faster
-            merge_penalty = 1.1 * FREE_GEM_WEIGHT
-            self.score = state.score - move[0].score - move[1].score + new_gem.score - merge_penalty
-            self._tops = state._tops - (move[0].part == Part.TOP) - (move[1].part == Part.TOP) + (new_gem.part == Part.TOP)
-            self._bottoms = state._bottoms - (move[0].part == Part.BOT) - (move[1].part == Part.BOT) + (new_gem.part == Part.BOT)
-            self._free = state._free - (move[0].free and move[1].free)
-            potential_score_bonus = 3 # this is not right, but I am not sure why we need it for e.g. tc45, tc58 and tc71
-            self.potential_score = potential_score_bonus + ceil(self.score) + 3 * min(self._tops, self._bottoms, self._free)
+            self.score = state.score + score
+            self._tops = state._tops + tops
+            self._bottoms = state._bottoms + bottoms
+            self._levels = tuple(map(add, state._levels, levels))
+            self._update_potential_score()
+
+    def _update_key(self):
+        self._packed = pack(self.counts)
+        self._mirror_packed = pack(_mirror_counts(self.counts))
+        self.packed = min(self._packed, self._mirror_packed)
+        self._key = None
+
+    @property
+    def key(self) -> Tuple[int, ...]:
+        """ Canonical counts, the same for the mirror image: the orientation with the lowest packed key """
+        if self._key is None:
+            self._key = _mirror_counts(self.counts) if self.is_mirrored() else self.counts
+        return self._key
 
     def _update_score(self):
-        score, tops, bottoms, free = 0, 0, 0, 0
-        for gem in self.gems:
-            score += gem.score
-            free += gem.free
-            bottoms += gem.part == Part.BOT
-            tops += gem.part == Part.TOP
-
-        self._tops = tops
-        self._bottoms = bottoms
-        self._free = free
-        
-        self.potential_score = ceil(score) + 3 * min(tops, bottoms, free)
-        self.score = score
+        counts = self.counts
+        self._tops = sum(counts[Part.TOP.value::4]) # Of every level, free or locked
+        self._bottoms = sum(counts[Part.BOT.value::4])
+        # Number of free gems of every level, followed by the number of locked gems of every level
+        self._levels = tuple(sum(counts[base:base + 4]) for base in (*range(0, NUM_KINDS, 8), *range(4, NUM_KINDS, 8)))
+        self.score = sum(map(mul, counts, SCORES)) - MERGE_WEIGHT * self.depth
+        self._update_potential_score()
+
+    def _update_potential_score(self):
+        """ Computes an upper bound of the score of this state and any state reachable from it
+
+        - The number of full keys only grows by merging a top with a bottom, using up at least
+          one free gem without a full key, and it can never exceed the number of free gems
+        - Full keys are worth 3 keys at level 4, but only as many gems as the levels below can
+          push up can ever be free at level 4
+        - A locked gem needs a free gem at its level, and below level 4 such a free gem can
+          unlock only one locked gem before it moves up
+        - Merges that were already done can not be undone """
+        levels = self._levels
+        full = sum(self.counts[Part.FULL.value::8]) # Free gems with a full key, of every level
+        num_full = full + min(self._tops, self._bottoms, sum(levels[:4]) - full)
+
+        locked_penalty = 0
+        pushed_up = 0 # Maximum number of (free) gems merged into the current level from below
+        for level in range(0,4):
+            num_free = pushed_up + levels[level]
+            num_locked = levels[level + 4]
+            if level < 3:
+                locked_penalty += max(0, num_locked - num_free)
+                pushed_up = min((num_free + num_locked) // 2, num_free)
+            elif num_free == 0:
+                locked_penalty += 2 * num_locked
+
+        # A full key is worth 3 keys when it ends up as one of the free gems at level 4
+        num_full_level4 = min(num_full, num_free)
+        self.potential_score = (KEY_WEIGHT * (num_full + 2 * num_full_level4) -
+                                LOCK_TILE_WEIGHT * locked_penalty - MERGE_WEIGHT * self.depth)
 
     def append(self, gem: Gem, count: int = 1):
         """ Appends a gem to the state (for building a new state) """
-        for _ in range(count):
-            self.gems.append(gem)
+        counts = list(self.counts)
+        counts[gem.kind] += count
+        self.counts = tuple(counts)
+        self._update_key()
         self._update_score()
 
+    def with_gems(self, counts: Tuple[int, ...]) -> State:
+        """ A copy of the state with the given number of gems of each kind added (or removed, if
+        negative), keeping the moves done so far """
+        state = State(self)
+        state.counts = tuple(map(sum, zip(self.counts, counts)))
+        state._update_key()
+        state._update_score()
+        return state
+
+    @property
+    def moves(self) -> List[Move]:
+        """ All merges done since the start, with the resulting gems, by following the parents """
+        moves = []
+        state = self
+        while state.move:
+            moves.append(state.move)
+            state = state.parent
+        return moves[::-1]
+
+    def gems(self) -> List[Gem]:
+        """ All gems in the state, sorted by kind """
+        return [gem for gem, count in zip(GEMS, self.counts) for _ in range(count)]
+
     def count_keys(self) -> Tuple[int]:
-        level3 = sum(gem.level == 2 and gem.part == Part.FULL for gem in self.gems)
-        level4 = sum(gem.level == 3 and gem.part == Part.FULL for gem in self.gems)
+        level3 = self.counts[(2 << 3) + Part.FULL.value]
+        level4 = self.counts[(3 << 3) + Part.FULL.value]
         return (level3, level4)
 
     def show_moves(self):
@@ -121,42 +333,430 @@ class State():
         for level in range(0,4):
             print(f"==Level {level + 1} Merges==")
             moves: List[Move] = []
-            for gem in self.gems:
-                for move in gem.moves:
-                    if move[0].level == level:
-                        one, two, result = sort_move(move)
-                        moves.append((one, two, result))
+            for move in self.moves:
+                if move[0].level == level:
+                    one, two, result = sort_move(move)
+                    moves.append((one, two, result))
 
             for move in sorted(moves):
                 print(f"{str(move[0]):>12} + {str(move[1]):<13} => {move[2]}")
 
     def num_locked(self) -> int:
         """ Number of locked tiles in a state """
-        return sum(gem.locked for gem in self.gems)
+        return sum(self._levels[4:])
 
     def potential_progress(self) -> int:
         """ Potential progress of this state.
 
         This equals number locked tiles plus locked level 3 tiles, since they account for 2 progress
         """
-        return self.num_locked() + sum(gem.locked and gem.level == 3 for gem in self.gems)
+        return self.num_locked() + self._levels[7]
 
     def num_unlocked_part(self) -> int:
         """ Number of unlocked gems with only a key part """
-        return sum(1 for gem in self.gems if gem.free and (gem.part == Part.TOP or gem.part == Part.BOT))
+        return sum(self.counts[Part.TOP.value::8]) + sum(self.counts[Part.BOT.value::8])
 
     def num_unlocked_empty(self) -> int:
         """ Number of unlocked gems with no key part """
-        return sum(1 for gem in self.gems if gem.free and gem.part == Part.EMPTY)
+        return sum(self.counts[Part.EMPTY.value::8])
+
+    def lowest_unlockable_level(self) -> int:
+        """ Lowest level with both locked and free gems, or 4 if there is none """
+        levels = self._levels
+        for level in range(0,4):
+            if levels[level] and levels[level + 4]:
+                return level
+        return 4
+
+    def signature(self, lowest_level: int = 0) -> Tuple[int, ...]:
+        """ What a state must have in common with another state to compare them with dominates:
+        the locked gems and the number of free gems of every level from lowest_level """
+        key = self.key
+        return tuple(count for level in range(lowest_level, 4)
+                     for count in (self._levels[level], *key[(level << 3) + 4:(level << 3) + 8]))
+
+    def dominates(self, other: State, lowest_level: int = 0) -> bool:
+        """ Whether this state can never do worse than another state with the same signature
+
+        Free gems of the same level can do the same merges, and merging a gem that has more key
+        parts always gives a gem with at least as many key parts. So this state must have gems with
+        at least as many key parts, on every level from lowest_level. The gems below that level will
+        not be merged anymore, so for those only their score is compared """
+        key, other_key = self.key, other.key
+        for base in range(lowest_level << 3, NUM_KINDS, 8):
+            full = key[base + Part.FULL.value] - other_key[base + Part.FULL.value]
+            tops = key[base + Part.TOP.value] - other_key[base + Part.TOP.value]
+            bottoms = key[base + Part.BOT.value] - other_key[base + Part.BOT.value]
+            if full < 0 or full + tops < 0 or full + bottoms < 0 or full + tops + bottoms < 0:
+                return False
+        if lowest_level == 0:
+            return True
+        base = lowest_level << 3
+        return (self.score - sum(map(mul, key[base:], SCORES[base:])) >=
+                other.score - sum(map(mul, other_key[base:], SCORES[base:])))
+
+    def is_mirrored(self) -> bool:
+        """ Whether the counts are the mirror image of the canonical key """
+        return self._mirror_packed < self._packed
 
     def __hash__(self) -> int:
-        return hash(tuple(self.gems))
+        return hash(self.packed)
 
     def __eq__(self, other: State):
-        return self.gems == other.gems
+        return self.packed == other.packed
 
     def __repr__(self):
-        return self.gems.__repr__()
+        return self.gems().__repr__()
+
+# Number of states a process of Solver.solve_parallel expands between reading the shared best score
+SHARE_EVERY = 64
+
+class Order(Enum):
+    """ Order in which the branch and bound expands its states """
+    DEPTH_FIRST = 0 # Most recently found state first
+    BEST_FIRST = 1 # Highest scoring state first, most recently found on ties
+    HYBRID = 2 # Deepest state first, highest scoring on ties
+
+class Frontier():
+    """ Priority queue of the states that still need to be expanded """
+
+    def __init__(self, order: Order):
+        self.order = order
+        self._heap: List[Tuple[Tuple[int, ...], State]] = []
+        self._pushed = 0
+        self._queued: Set[int] = set() # Ids of the states in the heap that were not discarded
+        self._discarded = 0
+
+    def push(self, state: State):
+        # The push counter makes every priority unique, so states themselves are never compared
+        self._pushed += 1
+        if self.order == Order.DEPTH_FIRST:
+            priority = (-self._pushed,)
+        elif self.order == Order.BEST_FIRST:
+            priority = (-state.score, -self._pushed)
+        else:
+            priority = (-state.depth, -state.score, -self._pushed)
+        heapq.heappush(self._heap, (priority, state))
+        self._queued.add(id(state))
+
+    def discard(self, state: State):
+        """ Makes sure a state is not returned by pop, if it is still queued """
+        if id(state) in self._queued:
+            self._queued.remove(id(state))
+            self._discarded += 1
+
+    def pop(self) -> State:
+        while True:
+            state = heapq.heappop(self._heap)[1]
+            if id(state) in self._queued:
+                self._queued.remove(id(state))
+                return state
+            self._discarded -= 1
+
+    def __len__(self) -> int:
+        return len(self._heap) - self._discarded
+
+def inert_gems(counts: Tuple[int, ...]) -> Tuple[int, ...]:
+    """ The number of gems of each kind that can be left out of the search, because some best
+    solution never merges them
+
+    - Locked gems of a level that no free gem can ever reach can never be unlocked
+    - A free level 4 full key can unlock every locked level 4 gem by itself, so any other full key
+      at level 4 does not need to be merged
+    - Every merge of a free level 4 gem without key parts either unlocks a gem or loses a free gem,
+      so only as many of them are needed as there are locked gems at level 4 """
+    inert = [0] * NUM_KINDS
+    pushed_up = 0 # Maximum number of (free) gems merged into the current level from below
+    for base in range(0, NUM_KINDS, 8):
+        num_free = pushed_up + sum(counts[base:base + 4])
+        num_locked = sum(counts[base + 4:base + 8])
+        if num_free == 0:
+            inert[base + 4:base + 8] = counts[base + 4:base + 8]
+        pushed_up = min((num_free + num_locked) // 2, num_free)
+
+    num_locked = sum(counts[28:32])
+    inert[24 + Part.FULL.value] = max(0, counts[24 + Part.FULL.value] - 1)
+    inert[24 + Part.EMPTY.value] = max(0, counts[24 + Part.EMPTY.value] - num_locked)
+    return tuple(inert)
+
+class Replacement(Enum):
+    """ Which entry a full transposition table gives up for a new one """
+    LRU = 0 # Least recently used entry
+    DEPTH = 1 # Deepest entry, since it saves the least work. A new entry deeper than all is not stored
+
+class TranspositionTable(dict):
+    """ Best result found for states, by packed key (or another key, like a signature), holding at
+    most max_entries of them (no limit if None). Use lookup and store, so the replacement policy
+    sees every use, and the hits and misses are counted """
+
+    def __init__(self, max_entries: Optional[int] = None, replacement: Replacement = Replacement.LRU):
+        super().__init__()
+        self.max_entries = max_entries
+        self.replacement = replacement
+        self._depths: Dict[int, List[int]] = {} # Packed keys of the entries by depth, for Replacement.DEPTH
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, packed: int):
+        """ The result stored for a packed key, or None """
+        result = self.get(packed)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.max_entries and self.replacement == Replacement.LRU:
+            # Move the entry to the end, so the first entry is always the least recently used
+            del self[packed]
+            self[packed] = result
+        return result
+
+    def store(self, packed: int, depth: int, result):
+        """ Stores the result for a packed key of a state at the given depth, if the policy allows """
+        if self.max_entries is None:
+            self[packed] = result
+            return
+        if packed not in self and len(self) >= self.max_entries:
+            if self.replacement == Replacement.LRU:
+                del self[next(iter(self))]
+            else:
+                deepest = max(self._depths)
+                if depth >= deepest:
+                    return
+                self.pop(self._depths[deepest].pop())
+                if not self._depths[deepest]:
+                    del self._depths[deepest]
+        if self.replacement == Replacement.DEPTH and packed not in self:
+            self._depths.setdefault(depth, []).append(packed)
+        self[packed] = result
+
+# Best merges from a level on for the boards solve and solve_by_level have seen (see
+# Solver._best_from_level), kept for all solves in this process
+LEVEL_CACHE = TranspositionTable(100000)
+# First level that solve_by_level solves board by board, with LEVEL_CACHE
+LEVEL_CACHE_FROM = 3
+
+def rss() -> int:
+    """ Resident memory of this process in bytes, or 0 where it can not be read (only on Linux) """
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+class SpillingSet():
+    """ Set of packed keys that moves its keys to a temporary sqlite database on disk whenever the
+    process uses more than max_rss bytes of memory. Checked every check_every added keys """
+
+    def __init__(self, max_rss: int, check_every: int = 4096):
+        self.max_rss = max_rss
+        self.check_every = check_every
+        self._memory: Set[int] = set()
+        self._disk: Optional[sqlite3.Connection] = None
+        self._spilled = 0
+
+    @staticmethod
+    def _blob(packed: int) -> bytes:
+        return packed.to_bytes(NUM_KINDS, "little")
+
+    def spill(self):
+        """ Moves the keys in memory to disk """
+        if self._disk is None:
+            # An empty name gives a private database on disk that is deleted when it is closed
+            self._disk = sqlite3.connect("")
+            self._disk.execute("CREATE TABLE keys (key BLOB PRIMARY KEY) WITHOUT ROWID")
+        self._disk.executemany("INSERT INTO keys VALUES (?)", ((self._blob(key),) for key in self._memory))
+        self._spilled += len(self._memory)
+        self._memory = set()
+
+    def add(self, packed: int):
+        if packed in self:
+            return
+        self._memory.add(packed)
+        if len(self._memory) % self.check_every == 0 and rss() > self.max_rss:
+            self.spill()
+
+    def update(self, keys):
+        for packed in keys:
+            self.add(packed)
+
+    def close(self):
+        """ Deletes the keys on disk """
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+            self._spilled = 0
+
+    def __contains__(self, packed: int) -> bool:
+        return packed in self._memory or (self._disk is not None and self._disk.execute(
+            "SELECT 1 FROM keys WHERE key = ?", (self._blob(packed),)).fetchone() is not None)
+
+    def __iter__(self):
+        yield from self._memory
+        if self._disk is not None:
+            for (blob,) in self._disk.execute("SELECT key FROM keys"):
+                yield int.from_bytes(blob, "little")
+
+    def __len__(self) -> int:
+        return len(self._memory) + self._spilled
+
+class SharedTable():
+    """ Fixed size hash table of packed keys with the lowest floor each state was reached with (see
+    move_order), in shared memory, so processes searching the same kernel can skip each other's states
+
+    The table is split in buckets of BUCKET slots and a key is only stored in its own bucket, so a
+    lock is only needed for the buckets sharing it. When a bucket is full, new keys are not stored """
+    BUCKET = 8
+    LOCKS = 64
+    _SLOT = NUM_KINDS + 1 # Packed key and floor rank (0 for an empty slot)
+
+    def __init__(self, entries: int):
+        self._buckets = max(1, entries // self.BUCKET)
+        self._memory = SharedMemory(create=True, size=self._buckets * self.BUCKET * self._SLOT)
+        self._memory.buf[:] = bytes(self._memory.size)
+        self._locks = [multiprocessing.Lock() for _ in range(self.LOCKS)]
+        self._owner = True
+
+    def __getstate__(self):
+        return (self._buckets, self._memory.name, self._locks)
+
+    def __setstate__(self, state):
+        self._buckets, name, self._locks = state
+        self._memory = SharedMemory(name)
+        self._owner = False
+
+    def visit(self, packed: int, floor: Tuple[int, ...]) -> bool:
+        """ Whether some process already reached the state with the same or a lower floor. If not,
+        the state is stored with this floor """
+        key = packed.to_bytes(NUM_KINDS, "little")
+        rank = FLOOR_RANKS[floor]
+        # Packed keys often only differ in a few bytes, which hash does not spread over the buckets
+        bucket = crc32(key) % self._buckets
+        buf = self._memory.buf
+        start = bucket * self.BUCKET * self._SLOT
+        with self._locks[bucket % self.LOCKS]:
+            for slot in range(start, start + self.BUCKET * self._SLOT, self._SLOT):
+                stored = buf[slot + NUM_KINDS]
+                if stored == 0:
+                    buf[slot:slot + NUM_KINDS] = key
+                    buf[slot + NUM_KINDS] = rank
+                    return False
+                if buf[slot:slot + NUM_KINDS] == key:
+                    if stored <= rank:
+                        return True
+                    buf[slot + NUM_KINDS] = rank
+                    return False
+        return False
+
+    def __len__(self) -> int:
+        buf = self._memory.buf
+        return sum(buf[slot] != 0 for slot in range(NUM_KINDS, len(buf), self._SLOT))
+
+    def close(self):
+        """ Detaches from the shared memory, and frees it in the process that created the table """
+        self._memory.close()
+        if self._owner:
+            self._memory.unlink()
+
+# Where solve keeps the results of the boards it solved, so it does not have to solve them again. None
+# to never use it
+SOLUTION_CACHE: Optional[str] = os.path.join(os.path.expanduser("~"), ".cache", "foe-anniversary",
+                                             "solutions.sqlite")
+
+class SolutionCache():
+    """ Results and merges of solved boards in a sqlite database on disk, by canonical packed key of
+    the board (the same for its mirror image) and solver version. When it holds more than
+    max_entries boards, the least recently used ones are removed
+
+    The boards looked up or stored are also kept in memory, so the database is only read for boards
+    this process has not seen yet. Which boards were used is written with the next put, or on close.
+    When the database can not be read or written, for example because another process keeps it
+    locked, boards are only looked up and stored in memory """
+
+    def __init__(self, path: str, max_entries: int = 100000):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_entries = max_entries
+        self._db = sqlite3.connect(path, timeout=30)
+        self._db.execute("CREATE TABLE IF NOT EXISTS solutions "
+                         "(key TEXT PRIMARY KEY, result TEXT, moves TEXT, used INTEGER)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS solutions_used ON solutions (used)")
+        self._pid = os.getpid() # A connection can not be used by processes forked from this one
+        self._memory = TranspositionTable(max_entries) # Results and merges by packed key
+        self._used: Set[str] = set() # Keys of the boards used since the last write
+        # Number of boards in the database, without the ones other processes stored since the last eviction
+        self._rows: int = len(self)
+
+    @staticmethod
+    def key(packed: int) -> str:
+        return f"{packed:x}:{VERSION}"
+
+    def get(self, packed: int) -> Optional[Tuple[Tuple[int, ...], List[Tuple[int, int]]]]:
+        """ The result and the merges (as pairs of gem kinds) stored for a board, or None """
+        solution = self._memory.lookup(packed)
+        if solution is None:
+            try:
+                row = self._db.execute("SELECT result, moves FROM solutions WHERE key = ?",
+                                       (self.key(packed),)).fetchone()
+            except sqlite3.Error:
+                return None
+            if row is None:
+                return None
+            solution = (tuple(json.loads(row[0])), [tuple(move) for move in json.loads(row[1])])
+            self._memory.store(packed, 0, solution)
+        self._used.add(self.key(packed))
+        return solution
+
+    def put(self, packed: int, result: Tuple[int, ...], moves: List[Tuple[int, int]]):
+        self._memory.store(packed, 0, (tuple(result), [tuple(move) for move in moves]))
+        self._used.discard(self.key(packed))
+        try:
+            with self._db:
+                self._write_used()
+                stored = self._db.execute("SELECT 1 FROM solutions WHERE key = ?", (self.key(packed),)).fetchone()
+                self._db.execute("INSERT OR REPLACE INTO solutions VALUES "
+                                 "(?, ?, ?, (SELECT COALESCE(MAX(used), 0) + 1 FROM solutions))",
+                                 (self.key(packed), json.dumps(result), json.dumps(moves)))
+                rows = self._rows + (stored is None)
+                if rows > self.max_entries:
+                    self._db.execute("DELETE FROM solutions WHERE key NOT IN "
+                                     "(SELECT key FROM solutions ORDER BY used DESC LIMIT ?)", (self.max_entries,))
+                    rows = self.max_entries
+            self._rows = rows
+        except sqlite3.Error:
+            pass # The board stays in memory only
+
+    def _write_used(self):
+        """ Marks the boards used since the last write as the most recently used ones """
+        self._db.executemany("UPDATE solutions SET used = (SELECT MAX(used) + 1 FROM solutions) WHERE key = ?",
+                             ((key,) for key in self._used))
+        self._used.clear()
+
+    def close(self):
+        """ Writes which boards were used, and closes the database """
+        try:
+            with self._db:
+                self._write_used()
+        except sqlite3.Error:
+            pass
+        self._db.close()
+
+    def __len__(self) -> int:
+        """ Number of boards in the database """
+        return self._db.execute("SELECT COUNT(*) FROM solutions").fetchone()[0]
+
+_solution_caches: Dict[str, SolutionCache] = {}
+
+def _solution_cache() -> Optional[SolutionCache]:
+    """ The cache at SOLUTION_CACHE, or None if it is not used or can not be opened """
+    if SOLUTION_CACHE is None:
+        return None
+    cache = _solution_caches.get(SOLUTION_CACHE)
+    if cache is None or cache._pid != os.getpid(): #pylint: disable=protected-access
+        try:
+            cache = _solution_caches[SOLUTION_CACHE] = SolutionCache(SOLUTION_CACHE)
+        except (OSError, sqlite3.Error):
+            return None
+        atexit.register(cache.close)
+    return cache
 
 class Solver():
     """ Contains the state of the game and the solver """
@@ -164,17 +764,17 @@ class Solver():
     def __init__(self, locked_bottom, locked_top, free, free_bottom, free_top, free_full):
         self.max_progress = sum(locked_bottom) + sum(locked_top) + locked_bottom[3] + locked_top[3]
 
-        self.start = State(EmptyState())
-        for level in range(0,4):
-            self.start.append(Gem(level, Part.BOT, True), locked_bottom[level])
-            self.start.append(Gem(level, Part.TOP, True), locked_top[level])
-            self.start.append(Gem(level, Part.EMPTY, False), free[level])
-            self.start.append(Gem(level, Part.BOT, False), free_bottom[level])
-            self.start.append(Gem(level, Part.TOP, False), free_top[level])
-            self.start.append(Gem(level, Part.FULL, False), free_full[level])
+        self.start = State(EmptyState()).with_gems(
+            board_counts([locked_bottom, locked_top, free, free_bottom, free_top, free_full]))
 
-        self.end_states: Set[State] = set()
-        self.best = self.start
+        # The search only needs to merge the kernel, the board without the inert gems
+        self.inert = inert_gems(self.start.counts)
+        self.kernel = self.start.with_gems(tuple(-count for count in self.inert))
+
+        self.end_states: Set[int] = set() # Packed keys of the states the last solve ended with
+        self.evaluated: Optional[int] = None # Number of states the last solve reached, if it does not keep end_states
+        self.best = self.kernel
+        self.incumbent = float("-inf") # Score that some solution is known to reach, see warm_start
 
     def help(self):
         print(f"Running fast optimized solver v{VERSION}")
@@ -192,7 +792,7 @@ class Solver():
 
         print("\nMerges should be done in the order below, starting with level 1 gems\n")
 
-    def show_results(self):
+    def show_results(self, cached: bool = False):
         self.best.show_moves()
         print("==Results==")
 
@@ -209,7 +809,7 @@ class Solver():
 
         keys = self.best.count_keys()
         res = keys[0] + 3*keys[1]
-        max_potential = ceil(self.start.potential_score)
+        max_potential = -(-self.start.potential_score // KEY_WEIGHT) # Rounded up to whole keys
 
         if res == max_potential:
             print(f"Keys: {res}/{max_potential} (Maximum keys picked up)")
@@ -222,42 +822,476 @@ class Solver():
 
         print(f"Progress: {total_progress}/{self.max_progress} ({remaining_locked} remaining locked gems)")
         print("Keep in mind these results are only for the selected color")
-        print(f" -- Score: {self.best.score:0.4f} out of {len(self.end_states)} evaluated games.")
+        if cached:
+            print(f" -- Score: {readable_score(self.best.score):0.4f} from the solution cache.")
+        else:
+            evaluated = len(self.end_states) if self.evaluated is None else self.evaluated
+            print(f" -- Score: {readable_score(self.best.score):0.4f} out of {evaluated} evaluated games.")
+
+    def warm_start(self, heuristic: str = "mooing15") -> int:
+        """ Runs a fast heuristic (see HEURISTICS) on the kernel, so solve only needs to look at the
+        states that can do at least as well as the heuristic """
+        board = board_lists(self.kernel.counts)
+        HEURISTICS[heuristic](*board)
+        end = State(EmptyState()).with_gems(board_counts(board))
+        score = end.score - MERGE_WEIGHT * (sum(self.kernel.counts) - sum(end.counts))
+        self.incumbent = max(self.incumbent, score)
+        return self.incumbent
+
+    def solve(self, order: Order = Order.BEST_FIRST, max_entries: Optional[int] = None,
+              root: Optional[State] = None, shared_best: Optional[multiprocessing.Value] = None,
+              shared_table: Optional[SharedTable] = None, max_expanded: Optional[int] = None) -> Optional[State]:
+        """ Solve the problem
+
+        States that can not do better than the best state found so far are not expanded. States that
+        can not reach the incumbent score are not expanded either, but they may still tie with it,
+        since the heuristic that reached it did not give a state to return.
+
+        With max_entries, the states of only that many signatures are remembered (see
+        TranspositionTable). States of a forgotten signature are no longer compared with it, so
+        the search may expand more states, but the result stays exact.
+
+        With root, only the states reachable from it are searched instead of the whole kernel. With
+        shared_best, the best score is shared with other processes searching the same kernel, and
+        used as incumbent (see solve_parallel). With shared_table, states that another process
+        already reached are skipped, since that process searches them. With max_expanded, the
+        search gives up after expanding that many states and returns None, keeping the best state
+        found so far in best.
+
+        After a level 4 merge, the best level 4 merges are looked up in LEVEL_CACHE (or found and
+        stored there) instead of searched """
+        frontier = Frontier(order)
+        frontier.push(self.kernel if root is None else root)
+        expanded = 0
+        # The states found so far that are not dominated by another state, by signature. A state
+        # reached with a lower floor can do more merges (see move_order), so a state only dominates
+        # states with the same or a higher floor
+        boards = TranspositionTable(max_entries)
+        while frontier:
+            if expanded == max_expanded:
+                return None
+            if shared_best is not None and expanded % SHARE_EVERY == 0:
+                self.incumbent = max(self.incumbent, shared_best.value)
+            expanded += 1
+            state = frontier.pop()
+            moves = self._find_good_moves(state, canonical=True)
+            for move in moves:
+                new_state = State(state, move)
+
+                if (new_state.potential_score <= self.best.score or
+                        new_state.potential_score < self.incumbent):
+                    continue
+                signature = new_state.signature()
+                group = boards.lookup(signature) or []
+                if any(board.floor <= new_state.floor and board.dominates(new_state) for board in group):
+                    continue
+                if shared_table is not None and shared_table.visit(new_state.packed, new_state.floor):
+                    continue
+                best = new_state
+                if move[0].level == 3:
+                    # Only level 4 merges can follow (see move_order), and LEVEL_CACHE may know the best
+                    # of them, so the state is not searched any further
+                    gained, level_moves = self._best_from_level(new_state, 3)
+                    if new_state.score + gained > self.best.score:
+                        for one, two in level_moves:
+                            best = State(best, (GEMS[one], GEMS[two]))
+                if best.score > self.best.score:
+                    self.best = best
+                    if shared_best is not None:
+                        with shared_best.get_lock():
+                            shared_best.value = max(shared_best.value, best.score)
+
+                remaining = [new_state]
+                for board in group:
+                    if new_state.floor <= board.floor and new_state.dominates(board):
+                        frontier.discard(board)
+                    else:
+                        remaining.append(board)
+                boards.store(signature, new_state.depth, remaining)
+                if move[0].level != 3:
+                    frontier.push(new_state)
+        self.end_states = {board.packed for group in boards.values() for board in group}
+        self.evaluated = None
+        self.best = self.best.with_gems(self.inert)
+        return self.best
+
+    def solve_parallel(self, workers: Optional[int] = None, order: Order = Order.BEST_FIRST,
+                       split: int = 4, table_entries: Optional[int] = 1 << 16, probe: int = 2000) -> State:
+        """ Solve the problem with the branch and bound on a pool of processes
+
+        The first merges are done here, one level of the search at the time, until there are split
+        times as many states as processes (or no merges are left). Every state is then searched by
+        one of the processes, which share the best score they find, so pruning works across them.
+        The best score is the same as with solve. Since dominance is only checked within each
+        process, more states are searched in total. With table_entries, the processes also skip
+        the states that another process already reached (see SharedTable).
+
+        Starting the processes only pays off for large searches, so solve is used instead with a
+        single process, when solve finishes within probe expanded states, or when the merges run out
+        or are pruned before there are split times as many states as processes """
+        workers = workers or os.cpu_count() or 1
+        if workers <= 1:
+            return self.solve(order)
+        if self.solve(order, max_expanded=probe) is not None:
+            return self.best
+        roots = [self.kernel]
+        while len(roots) < split * workers:
+            children = []
+            for state in roots:
+                moves = self._find_good_moves(state, canonical=True)
+                if not moves:
+                    children.append(state)
+                for move in moves:
+                    new_state = State(state, move)
+                    if (new_state.potential_score <= self.best.score or
+                            new_state.potential_score < self.incumbent):
+                        continue
+                    if new_state.score > self.best.score:
+                        self.best = new_state
+                    children.append(new_state)
+            if children == roots:
+                break
+            roots = [state for state in children if state.potential_score > self.best.score]
+        if len(roots) < split * workers:
+            return self.solve(order)
+
+        shared_best = multiprocessing.Value("q", max(self.best.score, self.incumbent))
+        shared_table = SharedTable(table_entries) if table_entries else None
+        board = board_lists(self.start.counts)
+        self.best = self.best.with_gems(self.inert)
+        self.end_states = set()
+        self.evaluated = None
+        try:
+            with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                     initargs=(shared_best, shared_table)) as pool:
+                futures = [pool.submit(_solve_subtree, board, root, order) for root in roots]
+                # In the order of the roots, so that the same best state is picked on ties every time
+                for future in futures:
+                    best, end_states = future.result()
+                    self.end_states |= end_states
+                    if best.score > self.best.score:
+                        self.best = best
+        finally:
+            if shared_table is not None:
+                shared_table.close()
+        return self.best
+
+    def solve_exact(self, max_entries: Optional[int] = None,
+                    replacement: Replacement = Replacement.LRU) -> State:
+        """ Solve the problem exactly by memoized recursion over the reachable boards
+
+        Since the score of a board does not depend on the order of the merges that led to it,
+        the best reachable score is computed only once for every board, regardless of search order.
+        With max_entries, only that many boards are remembered (see TranspositionTable), and the
+        others are computed again when they are reached again """
+        # Best reachable score and the first move towards it for every board. The move is stored for
+        # the canonical orientation of the board, so it also serves its mirror image
+        self.best_moves = TranspositionTable(max_entries, replacement)
+        best_moves = self.best_moves
+
+        def best_result(state: State) -> Tuple[int, Optional[Move]]:
+            result = best_moves.lookup(state.packed)
+            if result is None:
+                result = (state.score, None)
+                for move in self._find_good_moves(state):
+                    score = best_result(State(state, move))[0]
+                    if score > result[0]:
+                        result = (score, move)
+                if result[1] and state.is_mirrored():
+                    result = (result[0], mirror_move(result[1]))
+                best_moves.store(state.packed, state.depth, result)
+            return result
+
+        # Replay the best moves from the start to get the best state with its move history
+        self.best = self.kernel
+        move = best_result(self.kernel)[1]
+        while move:
+            self.best = State(self.best, mirror_move(move) if self.best.is_mirrored() else move)
+            move = best_result(self.best)[1]
+        self.end_states = set(best_moves)
+        self.evaluated = None
+        self.best = self.best.with_gems(self.inert)
+        return self.best
 
-    def solve(self) -> State:
-        """ Solve the problem """
-        stack = [self.start]
+    def solve_by_level(self, max_rss: Optional[int] = None) -> State:
+        """ Solve the problem exactly, one level at the time
+
+        Merges only move gems up, so any sequence of merges can be reordered to do all level 1
+        merges first, then level 2, etc. Only the boards that are not dominated by another board
+        are handed to the next level. Boards with gems left to unlock on the levels that are done
+        can not merge any higher, so they are not handed on either.
+
+        With max_rss, the visited boards are moved to disk whenever the process uses more memory
+        than that (see SpillingSet). The stack of boards to visit only grows with the number of
+        merges, so it stays in memory. The visited boards are not kept as end_states, only counted
+
+        From LEVEL_CACHE_FROM on, the boards are solved one by one, remembering the best merges in
+        LEVEL_CACHE, since the same higher levels come back for many boards and many solves """
+        def visited() -> Union[Set[int], SpillingSet]:
+            return SpillingSet(max_rss) if max_rss else set()
+
+        self.best = self.kernel
+        self.end_states = set()
+        self.evaluated = 1
+        boards = [self.kernel]
+        for level in range(0, LEVEL_CACHE_FROM):
+            seen = visited()
+            handed = len(boards) # Already counted by the level before
+            boards = self._solve_level(boards, level, seen)
+            self.evaluated += len(seen) - handed
+            if max_rss:
+                seen.close()
+        best_score, best_board, best_moves = self.best.score, self.best, ()
+        for board in boards:
+            score, moves = self._best_from_level(board, LEVEL_CACHE_FROM, max_rss)
+            if board.score + score > best_score:
+                best_score, best_board, best_moves = board.score + score, board, moves
+        self.best = best_board
+        for one, two in best_moves:
+            self.best = State(self.best, (GEMS[one], GEMS[two]))
+        self.best = self.best.with_gems(self.inert)
+        return self.best
+
+    def _solve_level(self, boards: List[State], level: int, seen: Union[Set[int], SpillingSet]) -> List[State]:
+        """ Does every merge of a level on the boards, keeping the best state. Returns the boards to
+        hand to the next level, and adds the packed keys of all boards it reached to seen """
+        outcomes: Dict[Tuple[int, ...], List[State]] = {}
+        seen.update(board.packed for board in boards)
+        stack = list(boards)
         while stack:
             state = stack.pop()
-            moves = self._find_good_moves(state)
-            for move in moves:
+            if state.score > self.best.score:
+                self.best = state
+
+            for move in self._find_good_moves(state):
+                if move[0].level != level:
+                    continue
                 new_state = State(state, move)
+                if new_state.packed not in seen:
+                    seen.add(new_state.packed)
+                    stack.append(new_state)
+
+            if state.lowest_unlockable_level() <= level:
+                continue
+            group = outcomes.setdefault(state.signature(level + 1), [])
+            if not any(board.dominates(state, level + 1) for board in group):
+                group[:] = [board for board in group if not state.dominates(board, level + 1)]
+                group.append(state)
+        return [board for group in outcomes.values() for board in group]
+
+    def _best_from_level(self, board: State, level: int,
+                         max_rss: Optional[int] = None) -> Tuple[int, Tuple[Tuple[int, int], ...]]:
+        """ Highest score gained from a board by merges from a level on, when no lower level has gems
+        left to unlock, and those merges as pairs of gem kinds. They only depend on the gems from
+        that level on, so they are kept in LEVEL_CACHE by the packed key of those gems (the same for
+        the mirror image). With max_rss, the visited boards are moved to disk like in solve_by_level """
+        counts = (0,) * (level << 3) + board.counts[level << 3:]
+        packed, mirror_packed = pack(counts), pack(_mirror_counts(counts))
+        mirrored = mirror_packed < packed
+        key = (level, min(packed, mirror_packed))
+        result = LEVEL_CACHE.lookup(key)
+        if result is None:
+            best = self.best
+            self.best = board
+            seen = SpillingSet(max_rss) if max_rss else set()
+            outcomes = self._solve_level([board], level, seen)
+            if self.evaluated is not None:
+                self.evaluated += len(seen) - 1
+            if max_rss:
+                seen.close()
+            score = self.best.score - board.score
+            moves = tuple((one.kind, two.kind) for one, two, _new_gem in self.best.moves[board.depth:])
+            if level < 3:
+                for outcome in outcomes:
+                    gained, outcome_moves = self._best_from_level(outcome, level + 1, max_rss)
+                    if outcome.score + gained - board.score > score:
+                        score = outcome.score + gained - board.score
+                        moves = tuple((one.kind, two.kind) for one, two, _new_gem in outcome.moves[board.depth:])
+                        moves += outcome_moves
+            self.best = best
+            # Stored for the orientation of the packed key
+            result = (score, tuple((MIRROR[one], MIRROR[two]) for one, two in moves) if mirrored else moves)
+            LEVEL_CACHE.store(key, 0, result)
+        score, moves = result
+        return score, tuple((MIRROR[one], MIRROR[two]) for one, two in moves) if mirrored else moves
 
-                if new_state in self.end_states or new_state.potential_score <= self.best.score:
+    def solve_iterative(self, cache_entries: Optional[int] = 64) -> State:
+        """ Solve the problem exactly with memory that only grows with the number of merges
+
+        Like IDA*, this searches depth first for states that can still reach a threshold, starting
+        at the potential score of the kernel. When the best state found does not reach the
+        threshold, the search starts over with the highest potential score of the states that fell
+        below it. States that can not beat the best state or the incumbent (see warm_start) are
+        left out.
+
+        With cache_entries, the boards of that many signatures (see State.signature) are remembered
+        for every number of merges during each search, and a state that one of them dominates
+        (see State.dominates) is not searched again. States with the same signature always have
+        done the same number of merges. Without them, the search repeats every board it reaches in
+        another way, which is far too slow for large boards """
+        self.best = self.kernel
+        self.end_states = set()
+        self.evaluated = None
+        threshold = self.kernel.potential_score
+        while True:
+            below = None # Highest potential score of the states below the threshold
+            # Boards by signature, for every number of merges
+            searched: List[TranspositionTable] = []
+            stack = [iter(self._find_good_moves(self.kernel, canonical=True))]
+            states = [self.kernel]
+            while stack:
+                move = next(stack[-1], None)
+                if move is None:
+                    stack.pop()
+                    states.pop()
+                    continue
+                new_state = State(states[-1], move)
+                if (new_state.potential_score <= self.best.score or
+                        new_state.potential_score < self.incumbent):
                     continue
+                if new_state.potential_score < threshold:
+                    if below is None or new_state.potential_score > below:
+                        below = new_state.potential_score
+                    continue
+                if cache_entries:
+                    while len(searched) <= new_state.depth:
+                        searched.append(TranspositionTable(cache_entries))
+                    signature = new_state.signature()
+                    group = searched[new_state.depth].lookup(signature) or []
+                    # A state reached with a higher floor can do fewer merges (see move_order)
+                    if any(board.floor <= new_state.floor and board.dominates(new_state) for board in group):
+                        continue
+                    group = [board for board in group
+                             if not (new_state.floor <= board.floor and new_state.dominates(board))]
+                    group.append(new_state)
+                    searched[new_state.depth].store(signature, new_state.depth, group)
                 if new_state.score > self.best.score:
                     self.best = new_state
+                stack.append(iter(self._find_good_moves(new_state, canonical=True)))
+                states.append(new_state)
 
-                self.end_states.add(new_state)
-                stack.append(new_state)
-            stack = sorted(stack, key=lambda x: x.score)
+            if below is None or below <= self.best.score:
+                break
+            # Potential scores differ by every merge, so lower the threshold to whole locked tiles to
+            # keep the number of searches down
+            threshold = below - below % LOCK_TILE_WEIGHT
+        self.best = self.best.with_gems(self.inert)
+        return self.best
 
-    def _find_good_moves(self, state: State):
+    def _find_good_moves(self, state: State, canonical: bool = False):
         """ Limit possible moves to the lowest level with merges of locked gems, 
-        but allow merging of two free gems in levels lower than that """
-        minlevel = min((level for level in range(0,4) if
-                        any(gem.locked and gem.level == level for gem in state.gems) and
-                        any(gem.free and gem.level == level for gem in state.gems)),
-                            default=4)
-        return set((one, two) for i, one in enumerate(state.gems)
-                    for two in state.gems[i+1:] if one.can_merge_with(two) and
-                        (one.level < minlevel or
-                            one.level == minlevel and (one.locked or two.locked)))
-
-def solve(locked_bottom,locked_top,free,free_bottom,free_top,free_full,silent=False) -> Tuple[int]: #pylint: disable=unused-argument
+        but allow merging of two free gems in levels lower than that
+
+        If canonical, only return merges that come after the last merge in the order of move_order """
+        counts = state.counts
+        kinds = [kind for kind, count in enumerate(counts) if count]
+        minlevel = state.lowest_unlockable_level()
+        moves = []
+        for i, one in enumerate(kinds):
+            if one >> 3 > minlevel:
+                break
+            merges = MERGES[one]
+            for two in kinds[i:]:
+                merge = merges[two]
+                if (merge is None or one == two and counts[one] < 2 or
+                        one >> 3 == minlevel and not (one | two) & 4 or
+                        canonical and merge[5] < state.floor):
+                    continue
+                moves.append((GEMS[one], GEMS[two]))
+        return moves
+
+def solve(locked_bottom,locked_top,free,free_bottom,free_top,free_full,silent=False,
+          order: Order = Order.BEST_FIRST, heuristic: Optional[str] = "mooing15",
+          max_entries: Optional[int] = None, cache: bool = True) -> Tuple[int]:
+    """ Solve the problem with the branch and bound, warm started with a heuristic (see HEURISTICS)
+    unless it is None. Unless cache is False, boards that were solved before are looked up in the
+    SOLUTION_CACHE instead """
     solver = Solver(locked_bottom,locked_top,free,free_bottom,free_top,free_full)
-    solver.solve()
+    solution_cache = _solution_cache() if cache else None
+    if solution_cache is not None:
+        cached = solution_cache.get(solver.start.packed)
+        if cached is not None:
+            result, moves = cached
+            if not silent:
+                # The merges are stored for the canonical orientation of the board
+                for one, two in moves:
+                    move = (GEMS[one], GEMS[two])
+                    solver.best = State(solver.best, mirror_move(move) if solver.start.is_mirrored() else move)
+                solver.best = solver.best.with_gems(solver.inert)
+                solver.help()
+                solver.show_results(cached=True)
+            return result
 
+    if heuristic:
+        solver.warm_start(heuristic)
+    solver.solve(order, max_entries)
+    result = _results(solver, locked_bottom, locked_top, free, silent)
+    if solution_cache is not None:
+        moves = [move if not solver.start.is_mirrored() else mirror_move(move) for move in solver.best.moves]
+        solution_cache.put(solver.start.packed, result, [(one.kind, two.kind) for one, two, _result in moves])
+    return result
+
+def solve_parallel(locked_bottom,locked_top,free,free_bottom,free_top,free_full,silent=False,
+                   workers: Optional[int] = None) -> Tuple[int]:
+    """ Same as solve, but using the branch and bound on a pool of processes """
+    solver = Solver(locked_bottom,locked_top,free,free_bottom,free_top,free_full)
+    solver.warm_start()
+    solver.solve_parallel(workers)
+    return _results(solver, locked_bottom, locked_top, free, silent)
+
+# Best score and table of reached states shared by the processes of Solver.solve_parallel, in each
+# of those processes
+_shared_best: Optional[multiprocessing.Value] = None
+_shared_table: Optional[SharedTable] = None
+
+def _init_worker(shared_best: multiprocessing.Value, shared_table: Optional[SharedTable]):
+    global _shared_best, _shared_table #pylint: disable=global-statement
+    _shared_best = shared_best
+    _shared_table = shared_table
+
+def _solve_subtree(board: List[List[int]], root: State, order: Order) -> Tuple[State, Set[int]]:
+    solver = Solver(*board)
+    solver.solve(order, root=root, shared_best=_shared_best, shared_table=_shared_table)
+    return solver.best, solver.end_states
+
+def solve_exact(locked_bottom,locked_top,free,free_bottom,free_top,free_full,silent=False,
+                max_entries: Optional[int] = None, replacement: Replacement = Replacement.LRU) -> Tuple[int]:
+    """ Same as solve, but using the memoized exact solver """
+    solver = Solver(locked_bottom,locked_top,free,free_bottom,free_top,free_full)
+    solver.solve_exact(max_entries, replacement)
+    return _results(solver, locked_bottom, locked_top, free, silent)
+
+def solve_by_level(locked_bottom,locked_top,free,free_bottom,free_top,free_full,silent=False,
+                   max_rss: Optional[int] = None) -> Tuple[int]:
+    """ Same as solve, but using the level by level exact solver """
+    solver = Solver(locked_bottom,locked_top,free,free_bottom,free_top,free_full)
+    solver.solve_by_level(max_rss)
+    return _results(solver, locked_bottom, locked_top, free, silent)
+
+def solve_iterative(locked_bottom,locked_top,free,free_bottom,free_top,free_full,silent=False,
+                    cache_entries: Optional[int] = 64) -> Tuple[int]:
+    """ Same as solve, but using the iterative deepening solver """
+    solver = Solver(locked_bottom,locked_top,free,free_bottom,free_top,free_full)
+    solver.solve_iterative(cache_entries)
+    return _results(solver, locked_bottom, locked_top, free, silent)
+
+def solve_kernel(solve_function, locked_bottom,locked_top,free,free_bottom,free_top,free_full,
+                 silent=False) -> Tuple[int]:
+    """ Runs any solve function (for example mooing15.solve) on the board without the inert gems
+    (see inert_gems), and adds the inert gems back into its results """
+    solver = Solver(locked_bottom,locked_top,free,free_bottom,free_top,free_full)
+    result = solve_function(*board_lists(solver.kernel.counts), silent=silent)
+
+    inert = solver.inert
+    inert_locked = sum(count for gem, count in zip(GEMS, inert) if gem.locked)
+    inert_locked_level4 = sum(inert[28:32])
+    inert_empty = sum(count for gem, count in zip(GEMS, inert) if gem.free and gem.part == Part.EMPTY)
+    return (result[0] + 3 * inert[24 + Part.FULL.value], 3 * sum(free),
+            3 * min(sum(locked_bottom),sum(locked_top)), result[3],
+            result[4] + inert_locked + inert_locked_level4, result[5] + inert_locked,
+            result[6], result[7] + inert_empty)
+
+def _results(solver: Solver, locked_bottom, locked_top, free, silent) -> Tuple[int]:
     max_keys = 3 * min(sum(locked_bottom),sum(locked_top))
     starting = 3 * sum(free)
 
@@ -273,3 +1307,35 @@ def solve(locked_bottom,locked_top,free,free_bottom,free_top,free_full,silent=Fa
     return (keys[0] + 3*keys[1], starting, max_keys,
             total_progress, solver.start.potential_progress(), solver.best.num_locked(),
             solver.best.num_unlocked_part(), solver.best.num_unlocked_empty())
+
+# Names of the six lists of a board and of the results of solve, as used by the batch command line
+BOARD_NAMES = ("locked_bottom", "locked_top", "free", "free_bottom", "free_top", "free_full")
+RESULT_NAMES = ("keys", "starting", "max_keys", "progress", "potential_progress", "remaining_locked",
+                "unlocked_part", "unlocked_empty")
+
+def solve_batch(boards: List[List[List[int]]], workers: Optional[int] = None,
+                solve_function=solve) -> List[Tuple[int]]:
+    """ Solves many boards (for example every color of every board of an event) on a pool of
+    processes, and returns the results of solve_function for each board, in order
+
+    Every board is given as the six lists passed to solve. Boards that are the same, or each other's
+    mirror image, are only solved once, since their results are the same """
+    unique: Dict[int, int] = {} # Index in boards of the first board with each canonical packed key
+    firsts: List[int] = []
+    for board in boards:
+        counts = board_counts(board)
+        firsts.append(unique.setdefault(min(pack(counts), pack(_mirror_counts(counts))), len(firsts)))
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {index: pool.submit(solve_function, *[list(values) for values in boards[index]], silent=True)
+                   for index in unique.values()}
+        return [futures[first].result() for first in firsts]
+
+if __name__ == "__main__":
+    # Batch command line: reads a JSON list of boards (objects with the names in BOARD_NAMES) from the
+    # file given as argument, or from standard input, and writes the results as a JSON list
+    with open(sys.argv[1], encoding="utf-8") if len(sys.argv) > 1 else sys.stdin as boards_file:
+        batch = json.load(boards_file)
+    results = solve_batch([[board[name] for name in BOARD_NAMES] for board in batch])
+    json.dump([dict(zip(RESULT_NAMES, result)) for result in results], sys.stdout, indent=1)
+    print()
@@ -1,5 +1,7 @@
 #!python3
 from math import floor, log
+import os
+import tempfile
 import types
 from enum import Enum
 from timeit import default_timer as timer
@@ -8,6 +10,10 @@ from test_cases import TestCaseType, tests_suite
 
 # active solver
 from solver import solve
+#from solver import solve_exact as solve
+#from solver import solve_by_level as solve
+#from solver import solve_iterative as solve
+#from solver import solve_parallel as solve
 #from mooing15 import solve
 #from my_solver import solve
 #from solver_v31 import solve
@@ -16,6 +22,7 @@ from solver import solve
 import mooing15 as solver_mooing15
 # other reference solvers used to establish best results in dev mode
 import solver as solver_optimized_bruteforce
+from solver import Solver, State, Replacement, LEVEL_CACHE, SpillingSet, SharedTable, SolutionCache, FLOOR_RANKS, solve_batch
 #import solver_v31
 
 
@@ -153,6 +160,11 @@ class TestCase():
 
 testcases = [TestCase(**args) for args in tests_suite]
 
+def test_inputs(test: TestCase) -> List[List[int]]:
+    """ fresh copies of a test's inputs, in the order of the solvers' arguments """
+    return [list(arg) for arg in (test.locked_bottom, test.locked_top, test.free,
+                                  test.free_bottom, test.free_top, test.free_full)]
+
 def check_duplicate_tests():
     """ check tests for duplicates (inputs, or names) """
     tests_inputs = {}  # dictionary of tests, key is tuple of test's inputs, value is tuple (index, test)
@@ -173,6 +185,157 @@ def check_duplicate_tests():
         else:
             tests_name[test.name] = (i, test)
 
+def check_potential_score():
+    """ check that the potential score is admissible, i.e. never lower than the best reachable score,
+    for all boards reachable from the tests' inputs """
+    for i, test in enumerate(testcases):
+        solver = Solver(*test_inputs(test))
+        solver.solve_exact()
+        # the best scores are stored by packed key, so walk the reachable boards again
+        stack = [solver.kernel]
+        seen = {solver.kernel.packed}
+        while stack:
+            state = stack.pop()
+            best_score = solver.best_moves[state.packed][0]
+            if state.potential_score < best_score:
+                print(f"Test #{i+1} '{test.name}' has potential score {state.potential_score} for {state}, "+
+                      f"but it can reach {best_score}")
+                break
+            for move in solver._find_good_moves(state): #pylint: disable=protected-access
+                new_state = State(state, move)
+                if new_state.packed not in seen:
+                    seen.add(new_state.packed)
+                    stack.append(new_state)
+
+def check_transposition_table():
+    """ check that the exact solver finds the same score when it can only remember 3/4 of the boards,
+    and the branch and bound when it can only remember 16 signatures, except for PERF tests since
+    forgetting boards makes their search much longer """
+    for i, test in enumerate(testcases):
+        if test.tctype & TestCaseType.PERF:
+            continue
+        solver = Solver(*test_inputs(test))
+        solver.solve_exact()
+        max_entries = max(1, len(solver.best_moves) * 3 // 4)
+        for replacement in Replacement:
+            bounded = Solver(*test_inputs(test))
+            bounded.solve_exact(max_entries, replacement)
+            if bounded.best.score != solver.best.score or len(bounded.best_moves) > max_entries:
+                print(f"Test #{i+1} '{test.name}' has score {bounded.best.score} with {len(bounded.best_moves)} "+
+                      f"of at most {max_entries} boards ({replacement.name}), but {solver.best.score} with all")
+        bounded = Solver(*test_inputs(test))
+        bounded.solve(max_entries=16)
+        if bounded.best.score != solver.best.score:
+            print(f"Test #{i+1} '{test.name}' has score {bounded.best.score} in the branch and bound with "+
+                  f"16 signatures, but {solver.best.score} in the exact solver")
+
+def check_parallel():
+    """ check that the parallel branch and bound finds the same score as the branch and bound when it
+    always starts the processes, except for PERF tests to keep the check short """
+    for i, test in enumerate(testcases):
+        if test.tctype & TestCaseType.PERF:
+            continue
+        solver = Solver(*test_inputs(test))
+        solver.warm_start()
+        solver.solve()
+        parallel = Solver(*test_inputs(test))
+        parallel.warm_start()
+        parallel.solve_parallel(workers=2, probe=0)
+        if parallel.best.score != solver.best.score:
+            print(f"Test #{i+1} '{test.name}' has score {parallel.best.score} with 2 processes, "+
+                  f"but {solver.best.score} in the branch and bound")
+
+def check_batch():
+    """ check that the batch solver gives the same results as solve for every board, in order, when
+    some boards are repeated or mirrored """
+    boards = [test_inputs(test) for test in testcases if not test.tctype & TestCaseType.PERF][-6:]
+    mirrored = [[top, bottom, free, free_top, free_bottom, free_full]
+                for bottom, top, free, free_bottom, free_top, free_full in boards[:3]]
+    boards += [boards[4], mirrored[0], boards[0], mirrored[2], mirrored[1], boards[2]]
+    expected = [solver_optimized_bruteforce.solve(*board, silent=True) for board in boards]
+    results = solve_batch(boards, workers=2)
+    if results != expected:
+        for i, (result, board_expected) in enumerate(zip(results, expected)):
+            if result != board_expected:
+                print(f"Board #{i+1} of the batch has result {result}, but {board_expected} with solve")
+
+def check_level_cache():
+    """ check that solving by level finds the same score as the branch and bound, both before and
+    after the level cache holds the higher levels of every test """
+    LEVEL_CACHE.clear()
+    for rerun in (False, True):
+        hits = LEVEL_CACHE.hits
+        for i, test in enumerate(testcases):
+            solver = Solver(*test_inputs(test))
+            solver.solve()
+            by_level = Solver(*test_inputs(test))
+            by_level.solve_by_level()
+            if by_level.best.score != solver.best.score:
+                print(f"Test #{i+1} '{test.name}' has score {by_level.best.score} by level "+
+                      f"{'with' if rerun else 'without'} the level cache, but {solver.best.score}")
+        if rerun and LEVEL_CACHE.hits == hits:
+            print("Level cache is not used when solving the tests again")
+
+def check_spilling_set():
+    """ check that a set of packed keys that is moved to disk all the time still holds the same keys """
+    keys = {test_key << (8 * i) for i in range(32) for test_key in (1, 3, 255)}
+    spilling = SpillingSet(max_rss=1, check_every=10)
+    spilling.update(keys)
+    spilling.update(keys)
+    if len(spilling) != len(keys) or set(spilling) != keys or 2 in spilling or any(key not in spilling for key in keys):
+        print(f"Spilling set holds {len(spilling)} keys, but {len(keys)} keys were added")
+    spilling.close()
+
+def check_shared_table():
+    """ check that the shared table only skips states reached again with the same or a higher floor """
+    floors = sorted(FLOOR_RANKS)
+    keys = [test_key << (8 * i) for i in range(32) for test_key in (1, 3, 255)]
+    table = SharedTable(1024)
+    if any(table.visit(key, floors[1]) for key in keys) or not all(table.visit(key, floors[1]) for key in keys):
+        print("Shared table does not skip states reached again with the same floor")
+    if not all(table.visit(key, floors[2]) for key in keys) or any(table.visit(key, floors[0]) for key in keys):
+        print("Shared table does not compare the floors of states reached again")
+    if len(table) != len(keys):
+        print(f"Shared table holds {len(table)} keys, but {len(keys)} keys were visited")
+    table.close()
+
+def check_solution_cache():
+    """ check that the solution cache returns what was stored and drops the least recently used boards,
+    also when one board is looked up again and again, and that it keeps working in memory when the
+    database can not be written """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "solutions.sqlite")
+        cache = SolutionCache(path, max_entries=5)
+        for packed in range(1, 6):
+            cache.put(packed, (packed, 2), [(8, 9)] * packed)
+        for _ in range(10):
+            stored = cache.get(1)
+        cache.put(6, (6, 2), [])
+        cache.put(6, (6, 2), [])
+        if stored != ((1, 2), [(8, 9)]) or cache.get(6) != ((6, 2), []):
+            print(f"Solution cache returns {stored} for a stored board")
+        if len(cache) != 5:
+            print(f"Solution cache holds {len(cache)} boards, but 6 boards were stored with room for 5")
+        cache.close()
+        # another process only sees the boards on disk
+        cache = SolutionCache(path, max_entries=5)
+        if cache.get(2) is not None or any(cache.get(packed) is None for packed in (1, 3, 4, 5, 6)):
+            print("Solution cache does not drop the least recently used board")
+        cache._db.close() #pylint: disable=protected-access
+        cache.put(7, (7, 2), [])
+        if cache.get(7) != ((7, 2), []):
+            print("Solution cache does not keep a board it can not write")
+        cache.close()
+
+def check_kernel():
+    """ check that leaving out the inert gems does not change the results of MooingCat's solver """
+    for i, test in enumerate(testcases):
+        result = solver_mooing15.solve(*test_inputs(test), silent=True)
+        kernel_result = solver_optimized_bruteforce.solve_kernel(solver_mooing15.solve, *test_inputs(test), silent=True)
+        if tuple(result) != tuple(kernel_result):
+            print(f"Test #{i+1} '{test.name}' has result {kernel_result} without the inert gems, "+
+                  f"but {result} with them")
+
 def run_test_suite():   
     tests_skipped=0
     tests_passed = 0
@@ -197,4 +360,15 @@ if __name__ == '__main__':
     print(f"\nTester version {version}\n")
 
     check_duplicate_tests()
+    check_potential_score()
+    check_transposition_table()
+    check_parallel()
+    check_batch()
+    check_level_cache()
+    check_spilling_set()
+    check_shared_table()
+    check_solution_cache()
+    check_kernel()
+    # Time the solvers, not the lookups of boards solved by earlier runs
+    solver_optimized_bruteforce.SOLUTION_CACHE = None
     run_test_suite()